@@ -1,6 +1,9 @@
 
-import json, subprocess, tempfile, os, re, random, sys
-from itertools import combinations
+import argparse, json, subprocess, tempfile, os, re, random, sys, hashlib, threading, heapq
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain, combinations, product
 from pathlib import Path
 
 
@@ -9,19 +12,31 @@ from pathlib import Path
 MODEL_PATH = "examples/shopping/minimal_model.smv"
 SETTINGS_PATH = "examples/shopping/settings.json"
 OUTPUT_DIR = "output_traces"
+CACHE_DIR = Path.home() / ".cache" / "ctd-tlp"    #nuXmv verdicts, reused across runs
 
 #parse the output trace from nuXmv
-STATE_RE = re.compile(r"^\s*->\s*State:")
-ASSIGN_RE = re.compile(r"^\s*([A-Za-z0-9_]+)\s*=\s*(.+?)\s*$")
+#nuXmv output is read as raw bytes: only the lines kept for a specification are ever decoded
 SPEC_VERDICT_RE = re.compile(
-    r"^\s*--\s*specification\b.*\bis\s+(true|false)\b",
+    rb"^\s*--\s*specification\b.*\bis\s+(true|false)\b",
     re.IGNORECASE
 )
+#one scan over the trace: a new state ("->" captured) or a variable assignment (var and val captured)
+#the value is matched greedily from its first to its last non-blank character, so the only
+#backtracking left is over trailing blanks and the captured value never needs a strip()
+TRACE_RE = re.compile(
+    r"^[ \t]*(?:(->)[ \t]*State:|([A-Za-z0-9_]+)[ \t]*=[ \t]*(\S(?:.*\S)?)[ \t\r]*$)",
+    re.MULTILINE
+)
+#show_traces repeats the counter example after this header, so parsing stops at its line
+TRACE_HEADER = "<!-- ################### Trace number:"
+TRACE_HEADER_BYTES = TRACE_HEADER.encode()
 
-def trace_to_test_line(stdout: str, cfg: dict) -> str:
+def parse_trace(stdout: str, cfg: dict):
     """
-    Convert a single nuXmv trace (stdout) into one test line for the shopping demo,
-    e.g. 'login,add,add,checkout'.
+    Read a single nuXmv trace (stdout) once and return both views of it:
+      - steps:   the step_var value of every state, as written to output_traces
+      - actions: the steps up to the end-of-test flag, without 'idle',
+                 as written to the generated test suite
 
     Uses:
       - cfg["step_var"] as the action variable (e.g. 'step')
@@ -30,74 +45,91 @@ def trace_to_test_line(stdout: str, cfg: dict) -> str:
     step_var = cfg["step_var"]
     end_flag = cfg.get("end")
 
+    steps = []
     actions = []
     current = {}
     pending = None
     end_reached = False
 
-    for line in stdout.splitlines():
-        # stop if nuXmv starts another trace header
-        if "<!-- ################### Trace number:" in line:
-            break
+    # nuXmv only prints the variables that changed, so a state is known once the next one starts
+    def finalize_state():
+        nonlocal end_reached
+        current.update(pending)
 
-        if STATE_RE.match(line):
-            # finalize previous state before starting a new one
-            if pending is not None:
-                current.update(pending)
+        # collect step
+        if step_var in current:
+            val = current[step_var].strip().strip('"').lower()
+            steps.append(val)
+            if not end_reached and val != "idle":
+                actions.append(val)
 
-                # collect step
-                if step_var in current:
-                    val = current[step_var].strip().strip('"').lower()
-                    if val != "idle":
-                        actions.append(val)
+        # check end-of-test
+        if not end_reached and end_flag and end_flag in current:
+            v = current[end_flag].strip().lower()
+            if v in ("true", "1"):
+                end_reached = True
 
-                # check end-of-test
-                if end_flag and end_flag in current:
-                    v = current[end_flag].strip().lower()
-                    if v in ("true", "1"):
-                        end_reached = True
-                        break
+    # stop at the line of the next trace header, if nuXmv printed one
+    stop = stdout.find(TRACE_HEADER)
+    endpos = len(stdout) if stop < 0 else stdout.rfind("\n", 0, stop) + 1
+
+    # findall hands back plain tuples, which is cheaper than a match object per line
+    for arrow, var, val in TRACE_RE.findall(stdout, 0, endpos):
+        if arrow:
+            # finalize previous state before starting a new one
+            if pending is not None:
+                finalize_state()
 
             # start collecting assignments for a new state
             pending = {}
-            continue
-
-        m = ASSIGN_RE.match(line)
-        if m and pending is not None:
-            var, val = m.group(1), m.group(2).strip()
+        elif pending is not None:
             pending[var] = val
 
-    # finalize last pending state if loop ended without a new STATE line
-    if not end_reached and pending is not None:
-        current.update(pending)
-        if step_var in current:
-            val = current[step_var].strip().strip('"').lower()
-            if val != "idle":
-                actions.append(val)
+    # finalize last pending state, there is no new STATE line after it
+    if pending is not None:
+        finalize_state()
 
-        if end_flag and end_flag in current:
-            v = current[end_flag].strip().lower()
-            if v in ("true", "1"):
-                end_reached = True
+    return steps, actions
 
+def trace_to_test_line(stdout: str, cfg: dict) -> str:
+    """
+    Convert a single nuXmv trace (stdout) into one test line for the shopping demo,
+    e.g. 'login,add,add,checkout'.
+    """
+    _, actions = parse_trace(stdout, cfg)
     return ",".join(actions)
 
+_NOT_PAREN_RE = re.compile(r"[^()]+")
+
 def assert_balanced_parentheses(s: str):
-    bal = 0
-    for ch in s:
-        if ch == '(':
-            bal += 1
-        elif ch == ')':
-            bal -= 1
-            if bal < 0:
-                raise ValueError(f"Too many ')' in phi:\n{s}")
-    if bal != 0:
+    # Keep only the parentheses and cancel every matching "()" until none are left.
+    # Both steps run in C, one replace pass per nesting level instead of a Python loop per character.
+    rest = _NOT_PAREN_RE.sub("", s)
+    while "()" in rest:
+        rest = rest.replace("()", "")
+
+    # what is left looks like ")))(((": a leading ')' means the balance went negative somewhere
+    if rest.startswith(")"):
+        raise ValueError(f"Too many ')' in phi:\n{s}")
+    if rest:
+        bal = s.count("(") - s.count(")")
         raise ValueError(f"Unbalanced parentheses (balance={bal}) in phi:\n{s}")
 
 #read the settings.json and load as dictionary
+#Parsed settings, keyed by (path, modification time): loading the same unchanged file again is a dict lookup.
+#The returned cfg is shared between callers, so it must be treated as read-only.
+_cfg_cache = {}
+
 def load_cfg(path):
-    with open(path) as f:
-        d = json.load(f)
+    key = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+    cfg = _cfg_cache.get(key)
+    if cfg is None:
+        cfg = _cfg_cache[key] = _parse_cfg(path)
+    return cfg
+
+def _parse_cfg(path):
+    with open(path, "rb") as f:
+        d = json.loads(f.read())
     facs = {}
 
     for f in d["factors"]:
@@ -149,23 +181,32 @@ def load_cfg(path):
     if "step_var" not in d:
         raise ValueError("Missing required 'step_var' in settings.json")
     
-    return {
+    end_flag = d.get("end_flag")
+    test_rule = d.get("test_rule", "TRUE")
+
+    # every value's formula already wrapped in parentheses, ready to be joined into a phi
+    for fac in facs.values():
+        fac["value_terms"] = {v: f"({ltl})" for v, ltl in fac["value_ltls"].items()}
+
+    cfg = {
         "factors": facs,
-        "end": d.get("end_flag"),
+        "end": end_flag,
         "step_var": d["step_var"],
-        "test_rule": d.get("test_rule", "TRUE")
+        "test_rule": test_rule,
+        # test_rule with the end_flag placeholder already substituted, shared by every phi
+        "_test_rule": test_rule.replace("end_flag", end_flag) if end_flag else test_rule,
     }
+    cfg["_guard"] = end_domain_guard(cfg)
+    return cfg
 
 
 #Create all the pairs combinations of the factor's values ((f1,v1),(f2,v2)...((fn-1,vn-1),(fn,vn))
+#The result is read-only: gen_tests copies it into its own todo set
 def all_pairs(factors):
-    names = list(factors)
-    ps = set()
-    for f1, f2 in combinations(names, 2):
-        for v1 in factors[f1]["values"]:
-            for v2 in factors[f2]["values"]:
-                ps.add(((f1, v1), (f2, v2)))
-    return ps
+    legs = {name: [(name, v) for v in fac["values"]] for name, fac in factors.items()}
+    return frozenset(chain.from_iterable(
+        product(legs[f1], legs[f2]) for f1, f2 in combinations(legs, 2)
+    ))
 
 # Keep the int values according to what was assigned in the settings.json
 def end_domain_guard(cfg):
@@ -180,136 +221,302 @@ def phi_for_row(row, cfg):
     Build the LTL formula for a *full CTD row*:
     test_rule & guard & (AND over all factor value LTLs).
     """
-    guard = end_domain_guard(cfg)          # currently "TRUE"
-    test_rule = cfg.get("test_rule", "TRUE")
-    end_flag = cfg.get("end")
-
-    if end_flag:
-        test_rule = test_rule.replace("end_flag", end_flag)
+    facs = cfg["factors"]
 
     # Conjunction of all factor-value formulas from settings.json
-    ltl_parts = []
-    for name, value in row.items():
-        ltl_parts.append(f"({phi_for_value(name, value, cfg)})")
-
-    core = " & ".join(ltl_parts) if ltl_parts else "TRUE"
+    core = " & ".join(facs[name]["value_terms"][value] for name, value in row.items()) or "TRUE"
 
-    return f"(({test_rule}) & ({guard}) & ({core}))"
+    return f"(({cfg['_test_rule']}) & ({cfg['_guard']}) & ({core}))"
 
 def phi_for_pair(pair, cfg):
     """
     Build the LTL formula for a single CTD pair (f1=v1, f2=v2),
     combined with the global test_rule.
     """
-    (f1, v1), (f2, v2) = pair
+    # order the legs by factor name, so both orientations of a pair give the same formula (and cache entry)
+    (f1, v1), (f2, v2) = sorted(pair, key=lambda leg: leg[0])
 
-    phi1 = cfg["factors"][f1]["value_ltls"][v1]
-    phi2 = cfg["factors"][f2]["value_ltls"][v2]
+    phi1 = cfg["factors"][f1]["value_terms"][v1]
+    phi2 = cfg["factors"][f2]["value_terms"][v2]
 
-    test_rule = cfg.get("test_rule", "TRUE")
-    end_flag = cfg.get("end")
+    return f"(({cfg['_test_rule']}) & ({phi1} & {phi2}))"
 
-    if end_flag:
-        test_rule = test_rule.replace("end_flag", end_flag)
 
-    core = f"({phi1}) & ({phi2})"
-    return f"(({test_rule}) & ({core}))"
 
+#Strip redundant whitespace, so formulas that only differ in layout share a cache entry.
+#phi_for_row/phi_for_pair always build the same outer shape, so the parentheses need no normalizing
+@lru_cache(maxsize=None)
+def normalize_phi(phi):
+    return " ".join(phi.split())
 
+_verdict_cache = {}
+
+#Entries are keyed by the model's contents, so a touched, copied or re-checked-out model keeps its verdicts.
+#Verdict-only results (traces=False) carry no counter example, so they are kept apart from full results.
+#`digest` is model_digest(model), computed once by the caller for a whole batch of formulas
+def verdict_cache_key(digest, phi, traces=True):
+    kind = "" if traces else "\0verdict"
+    return hashlib.blake2b(f"{digest}\0{normalize_phi(phi)}{kind}".encode()).hexdigest()
+
+_model_digests = {}
+
+#sha256 of the model file, only read again when its size or modification time changes
+def model_digest(model):
+    st = os.stat(model)
+    stamp = (model, st.st_mtime_ns, st.st_size)
+    digest = _model_digests.get(stamp)
+    if digest is None:
+        # hashed straight from the open file, so a large model is never loaded as a whole
+        with open(model, "rb") as f:
+            digest = _model_digests[stamp] = hashlib.file_digest(f, "sha256").hexdigest()
+    return digest
+
+def verdict_cache_get(key):
+    if key in _verdict_cache:
+        return _verdict_cache[key]
+    try:
+        d = json.loads((CACHE_DIR / f"{key}.json").read_text(encoding="utf-8"))
+        res = (d["status"], d["out"])
+    except (OSError, ValueError, KeyError, TypeError):
+        # unreadable or malformed entries count as a miss and are overwritten by the fresh result
+        return None
+    _verdict_cache[key] = res
+    return res
+
+def verdict_cache_put(key, res):
+    _verdict_cache[key] = res
+    status, out = res
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # write to a temporary name first so concurrent readers never see a partial file
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=CACHE_DIR)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"status": status, "out": out}, f)
+        os.replace(tmp, CACHE_DIR / f"{key}.json")
+    except OSError:
+        pass
 
 #Run nuXmv as the oracle by sending the not(phi) and returning the counter example output if the row is feasible, if True is returned the pair is infeasible return None.
-def run_nuxmv(model, phi, timeout_sec=30):
-    assert_balanced_parentheses(phi)
-    script = (
-        f"read_model -i {model}\n"
-        "go\n"
-        f"check_ltlspec -p \"!( {phi} )\"\n"
-        "show_traces -v\n"
-        #"show_traces\n"
-        "quit\n"                                #The script that runs the nuXmv
-    )
-    
-    # make sure the temp file is cleaned
-    with tempfile.NamedTemporaryFile("w", suffix=".cmd", delete=False) as f:
-        f.write(script)
-        cmd = f.name   
+def run_nuxmv(model, phi, timeout_sec=30, traces=True):
+    status, out = run_nuxmv_batch(model, [phi], timeout_sec, traces)[0]
+    return status, out
+
+#Same oracle, but for a list of formulas: every phi is checked in the same long-lived nuXmv session, where the model was read and built once (go).
+#Verdicts are cached per (model contents, phi), so only formulas that were never checked against this version of the model reach nuXmv.
+def run_nuxmv_batch(model, phis, timeout_sec=30, traces=True):
+    """
+    Returns one (status, out) per phi, in the same order as phis.
+    `out` is the slice of the nuXmv output that belongs to that specification
+    (its verdict line followed by the counter example, if any).
+    With traces=False only the verdicts are needed: show_traces is skipped and `out` is just the verdict line.
+    """
+    digest = model_digest(model)
+    keys = [verdict_cache_key(digest, phi, traces) for phi in phis]
+    results = [verdict_cache_get(k) for k in keys]
+    if not traces:
+        # a full result answers a verdict-only question as well
+        results = [res or verdict_cache_get(verdict_cache_key(digest, phi)) for phi, res in zip(phis, results)]
+
+    missing = [i for i, res in enumerate(results) if res is None]
+    if missing:
+        fresh = _run_nuxmv_session(model, [phis[i] for i in missing], timeout_sec, traces)
+        for i, res in zip(missing, fresh):
+            verdict_cache_put(keys[i], res)
+            results[i] = res
+
+    return results
+
+def _run_nuxmv_session(model, phis, timeout_sec, traces=True):
+    for phi in phis:
+        assert_balanced_parentheses(phi)
+
+    session = nuxmv_session(model, timeout_sec)
     try:
-        try:
-            proc = subprocess.run(
-                ["nuXmv", "-source", cmd],
-                capture_output=True,
-                text=True,
-                timeout=timeout_sec
-            )
+        return session.check(phis, timeout_sec, traces)
+    except RuntimeError:
+        # the process may be dead or out of sync, the next call starts a fresh one
+        drop_nuxmv_session(model)
+        raise
 
-        except subprocess.TimeoutExpired as e:
-            raise RuntimeError(
-                f"nuXmv timed out after {timeout_sec} seconds for phi:\n{phi}"
-            ) from e
+#The interactive shell prints its prompt before the output of every command
+NUXMV_PROMPT_RE = re.compile(rb"^(?:nuXmv > )+")
 
-        out = (proc.stdout or "") + "\n" + (proc.stderr or "")
+#What read_model/go print when the model cannot be parsed, flattened or built (the "***" banner lines are skipped)
+MODEL_LOAD_ERROR_RE = re.compile(rb"error|undefined|cannot|can't", re.IGNORECASE)
 
-        verdict = None
-        for line in out.splitlines():
-            
-            m = SPEC_VERDICT_RE.match(line)
-            if m:
-                verdict = m.group(1).lower()
+class NuxmvSession:
+    """
+    One long-lived `nuXmv -int` process with the model already read and built (go),
+    so each query only pays for its own check_ltlspec instead of a full model load.
+    Every group of commands ends with an echo of SENTINEL, which tells us where its output stops.
+    The sentinel is a plain word: in the nuXmv shell '#' starts a comment, so it would not be echoed back.
+    """
+    SENTINEL = b"CTD_TLP_END_OF_BATCH"
+
+    def __init__(self, model, timeout_sec=30):
+        self.model = model
+        self.proc = subprocess.Popen(
+            ["nuXmv", "-int"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT
+        )
+        try:
+            tail = self._run(f"read_model -i {model}\ngo\n", timeout_sec, lambda line: None)
+        except RuntimeError:
+            self.close()
+            raise
+
+        # a model that failed to load would otherwise only show up later as unparsable verdicts
+        if any(MODEL_LOAD_ERROR_RE.search(line) for line in tail if not line.startswith(b"***")):
+            self.close()
+            raise RuntimeError(
+                f"nuXmv could not load the model {model}\n"
+                f"Raw output (last {len(tail)} lines):\n" + b"".join(tail).decode(errors="replace")
+            )
+
+    def _run(self, commands, budget, on_line):
+        """Send commands, pass each output line to on_line until the sentinel comes back, and return the last lines."""
+        timed_out = threading.Event()
 
-        if verdict == "false":
-            return "FEASIBLE", out
-        if verdict == "true":
-            return "INFEASIBLE", out
+        def kill_on_timeout():
+            timed_out.set()
+            self.proc.kill()
 
+        def feed():
+            try:
+                self.proc.stdin.write(commands.encode() + b"echo " + self.SENTINEL + b"\n")
+                self.proc.stdin.flush()
+            except (OSError, ValueError):
+                pass                    # nuXmv already exited, reported below
+
+        tail = deque(maxlen=200)        # the last lines of output, only used for error messages
+        timer = threading.Timer(budget, kill_on_timeout)
+        timer.start()
+        # commands are written from their own thread while this one drains stdout: a batch larger than
+        # the pipe buffer would otherwise block both sides, nuXmv on its output and us on its input
+        writer = threading.Thread(target=feed, daemon=True)
+        writer.start()
+        try:
+            for line in self.proc.stdout:
+                line = NUXMV_PROMPT_RE.sub(b"", line)
+                if line.strip() == self.SENTINEL:
+                    return tail
+                tail.append(line)
+                on_line(line)
+        finally:
+            timer.cancel()
+            writer.join()
+
+        if timed_out.is_set():
+            raise RuntimeError(f"nuXmv timed out after {budget} seconds in session for {self.model}")
         raise RuntimeError(
-            f"Could not parse nuXmv verdict (neither true nor false) for phi:\n{phi}\n\n"
-            f"Raw output:\n{out}"
+            f"nuXmv exited unexpectedly in session for {self.model}\n"
+            f"Raw output (last {len(tail)} lines):\n" + b"".join(tail).decode(errors="replace")
         )
 
-    finally:
-        try:
-            os.remove(cmd)
-        except OSError:
-            pass
-            
-def extract_steps(stdout, cfg):
-    step_var = cfg["step_var"]
-    steps = []
+    def check(self, phis, timeout_sec=30, traces=True):
+        show = "show_traces -v\n" if traces else ""
+        checks = "".join(
+            f"check_ltlspec -p \"!( {phi} )\"\n{show}"
+            for phi in phis
+        )
 
-    current = {}
-    pending = None
-    
-    for line in stdout.splitlines():
-        if "<!-- ################### Trace number:" in line:
-            break
+        verdicts = []                   # "true"/"false" per specification, in the order they were checked
+        blocks = []                     # the output lines kept for each specification
+        complete = [False]              # the latest specification needs no more output
 
-        if STATE_RE.match(line):
+        def on_line(line):
+            # only lines containing "specification" are handed to the verdict regex
+            m = SPEC_VERDICT_RE.match(line) if b"specification" in line else None
+            if m:
+                verdicts.append(m.group(1).decode("ascii").lower())
+                blocks.append([line])
+                # a true verdict comes without a counter example, and without traces only the verdict is kept
+                complete[0] = verdicts[-1] == "true" or not traces
+            elif blocks and not complete[0]:
+                blocks[-1].append(line)
+                # from the trace header on, show_traces only repeats the counter example we already have
+                complete[0] = TRACE_HEADER_BYTES in line
+
+        # the time budget grows with the number of specifications in the call
+        budget = timeout_sec * len(phis)
+        try:
+            tail = self._run(checks, budget, on_line)
+        except RuntimeError as e:
+            raise RuntimeError(f"{e}\nfor phis:\n" + "\n".join(phis)) from None
 
-            if pending is not None:
-                current.update(pending)
-                if step_var in current:
-                    val = current[step_var].strip().strip('"').lower()
-                    steps.append(val)
-            pending = {}     # NEW: start collecting assignments for this state
-            continue
-        
-        m = ASSIGN_RE.match(line)
-        if m and pending is not None:
-            pending[m.group(1)] = m.group(2).strip()
+        if len(verdicts) != len(phis):
+            raise RuntimeError(
+                f"Could not parse nuXmv verdict (neither true nor false) for every phi: "
+                f"expected {len(phis)}, found {len(verdicts)}\n" + "\n".join(phis) + "\n\n"
+                f"Raw output (last {len(tail)} lines):\n" + b"".join(tail).decode(errors="replace")
+            )
 
-    if pending is not None:
-        current.update(pending)
-        if step_var in current:
-            val = current[step_var].strip().strip('"').lower()
-            steps.append(val)
+        return [
+            ("FEASIBLE" if verdict == "false" else "INFEASIBLE", b"".join(lines).decode(errors="replace"))
+            for verdict, lines in zip(verdicts, blocks)
+        ]
+
+    def close(self):
+        try:
+            self.proc.stdin.write(b"quit\n")
+            self.proc.stdin.close()
+            self.proc.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.proc.kill()
+            self.proc.wait()
+        finally:
+            self.proc.stdout.close()
+
+#One session per (thread, model): the worker threads of gen_tests each keep their own nuXmv process
+_session_local = threading.local()
+_open_sessions = []
+_open_sessions_lock = threading.Lock()
+
+def nuxmv_session(model, timeout_sec=30):
+    sessions = _session_local.__dict__.setdefault("sessions", {})
+    session = sessions.get(model)
+    # a session closed by close_nuxmv_sessions (from another thread) is replaced as well
+    if session is None or session.proc.poll() is not None:
+        session = NuxmvSession(model, timeout_sec)
+        sessions[model] = session
+        with _open_sessions_lock:
+            _open_sessions.append(session)
+    return session
+
+def drop_nuxmv_session(model):
+    session = _session_local.__dict__.get("sessions", {}).pop(model, None)
+    if session is not None:
+        with _open_sessions_lock:
+            if session in _open_sessions:
+                _open_sessions.remove(session)
+        session.close()
+
+#Quit every nuXmv process that is still open, from any thread
+def close_nuxmv_sessions():
+    with _open_sessions_lock:
+        sessions = list(_open_sessions)
+        _open_sessions.clear()
+    for session in sessions:
+        session.close()
+    _session_local.__dict__.pop("sessions", None)
+            
+def extract_steps(stdout, cfg):
+    steps, _ = parse_trace(stdout, cfg)
     return steps
     
 #Files that are created to keep the traces for the test steps called in a name as: run_A0_B5_C1.txt
 def filename_for_row(row):
+    return _filename_for_key(row_key(row))
+
+
+# The same rows are named when saved and again when pruning, so build each name once
+@lru_cache(maxsize=None)
+def _filename_for_key(key):
     parts = []
-    for name in sorted(row.keys()):
+    for name, value in key:
         letter = name[0].upper()
-        value = row[name]
         num = 1 if value is True else 0 if value is False else value
         parts.append(f"{letter}{num}")
     return "run_" + "_".join(parts) + ".txt"
@@ -320,8 +527,7 @@ def row_key(row):
 
 
 #save the trace of the row or just return
-def save_steps(row, stdout, cfg, output_dir=OUTPUT_DIR):
-    steps = extract_steps(stdout, cfg)
+def save_steps(row, steps, output_dir=OUTPUT_DIR):
     if not steps:
         return
 
@@ -330,9 +536,9 @@ def save_steps(row, stdout, cfg, output_dir=OUTPUT_DIR):
 
     filename = filename_for_row(row)
 
+    payload = "".join(f"{i}. {s}\n" for i, s in enumerate(steps, start=1))
     with open(out_dir / filename, "w") as f:
-        for i, s in enumerate(steps, start=1):
-            f.write(f"{i}. {s}\n")
+        f.write(payload)
 
 def prune_output_files(chosen_tests, output_dir=OUTPUT_DIR):
     out_dir = Path(output_dir)
@@ -360,14 +566,10 @@ def write_generated_tests_file(
     out_path = Path(path)
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
+    # Skip rows that somehow have no mapped line (should not happen normally)
+    lines = (row_to_line.get(row_key(row), "") for row in tests)
     with open(out_path, "w", encoding="utf-8") as f:
-        for row in tests:
-            key = row_key(row)
-            line = row_to_line.get(key, "")
-            # Skip rows that somehow have no mapped line (should not happen normally)
-            if not line:
-                continue
-            f.write(line + "\n")
+        f.writelines(f"{line}\n" for line in lines if line)
 
 def run_scorer_on_generated(path: str = "tests/generated_suite.txt") -> None:
     """
@@ -423,59 +625,115 @@ def pair_is_feasible(pair, cfg, model):
     Returns True if the pair is feasible, False otherwise.
     """
     phi = phi_for_pair(pair, cfg)
-    status, _ = run_nuxmv(model, phi)
+    status, _ = run_nuxmv(model, phi, traces=False)
     return (status == "FEASIBLE")
 
+def test_rows(rows, cfg, model):
+    """
+    Batched test_row: all rows are checked in a single nuXmv session.
+    Returns a list of (is_feasible: bool, stdout), in the order of rows.
+    """
+    phis = [phi_for_row(row, cfg) for row in rows]
+    return [(status == "FEASIBLE", out) for status, out in run_nuxmv_batch(model, phis)]
+
+def pairs_are_feasible(pairs, cfg, model):
+    """
+    Batched pair_is_feasible: all pairs are checked in a single nuXmv session.
+    Returns a list of booleans, in the order of pairs.
+    """
+    phis = [phi_for_pair(pair, cfg) for pair in pairs]
+    return [status == "FEASIBLE" for status, _ in run_nuxmv_batch(model, phis, traces=False)]
+
+#Split the items into at most n consecutive slices of (nearly) equal size, none longer than max_size
+def split_batches(items, n, max_size=None):
+    size = max(1, (len(items) + n - 1) // n)
+    if max_size:
+        size = min(size, max_size)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
 #Checks which pairs are covered by the row
 def row_satisfies(row, pair):
     (f1, v1), (f2, v2) = pair
     return row.get(f1) == v1 and row.get(f2) == v2
 
-def pairs_covered_by_row(row, all_pairs_set): 
-    return {p for p in all_pairs_set if row_satisfies(row, p)}
+#A row of F factors covers exactly F*(F-1)/2 pairs, so build them from the row instead of scanning every pair.
+#all_pairs orders the two legs by factor definition order, which need not match the row's key order: try both.
+def pairs_covered_by_row(row, all_pairs_set):
+    covered = set()
+    for a, b in combinations(row.items(), 2):
+        if (a, b) in all_pairs_set:
+            covered.add((a, b))
+        elif (b, a) in all_pairs_set:
+            covered.add((b, a))
+    return covered
+
+#Give every pair its own bit, so that a set of pairs is a single int and set algebra is integer & | ~
+def pair_bits(pairs):
+    return {p: 1 << i for i, p in enumerate(pairs)}
 
 def minimize_tests_greedy(tests, feasible_pairs):
-    # Precompute coverage per test
-    cov = [pairs_covered_by_row(t, feasible_pairs) for t in tests]
+    # Precompute coverage per test, as a bitmask over the feasible pairs
+    bit = pair_bits(feasible_pairs)
+    cov = [sum(bit[p] for p in pairs_covered_by_row(t, feasible_pairs)) for t in tests]
 
-    remaining = set(feasible_pairs)
+    remaining = (1 << len(bit)) - 1
     chosen = []
-    used = set()
-
-    # Greedy pick: each time choose the test that covers most remaining pairs
-    while remaining:
-        best_i = None
-        best_gain = set()
-
-        for i, cset in enumerate(cov):
-            if i in used:
-                continue
-            gain = cset & remaining
-            if len(gain) > len(best_gain):
-                best_gain = gain
-                best_i = i
-
-        if best_i is None:
+
+    # Greedy pick: each time choose the test that covers most remaining pairs.
+    # Gains only shrink as pairs get covered, so a key on the heap is an upper bound of the
+    # test's real gain: recompute it for the top entry only, and take the test if it is still exact.
+    # (-gain, i) keeps the old tie-break, the lowest index wins.
+    heap = [(-c.bit_count(), i) for i, c in enumerate(cov)]
+    heapq.heapify(heap)
+
+    while remaining and heap:
+        neg_gain, i = heapq.heappop(heap)
+        gain = (cov[i] & remaining).bit_count()
+
+        if gain != -neg_gain:
+            heapq.heappush(heap, (-gain, i))
+            continue
+
+        if gain == 0:
             # Should not happen if tests truly cover feasible_pairs
             break
 
-        used.add(best_i)
-        chosen.append(tests[best_i])
-        remaining -= best_gain
+        chosen.append(tests[i])
+        remaining &= ~cov[i]
 
     return chosen
 
-def build_row_from_pair(pair, cfg):
+def build_row_from_pair(pair, cfg, todo=frozenset(), infeasible_pairs=frozenset()):
     """
-    TEMPORARY: build a full row that agrees with the given pair,
-    and assigns a default value (first in domain) to all other factors.
+    Build a full row that agrees with the given pair, growing it one factor at a time (IPO-style):
+    every other factor takes the value that covers the most pending (todo) pairs together with
+    the factors already in the row. Values forming a known infeasible pair are only used when
+    there is no other choice, and ties are broken randomly.
     """
     (f1, v1), (f2, v2) = pair
     row = {f1: v1, f2: v2}
     for name, fac in cfg["factors"].items():
         if name in row:
             continue
-        row[name] = fac["values"][0]
+
+        best, best_score = [], None
+        for value in fac["values"]:
+            leg = (name, value)
+            score = 0
+            for other in row.items():
+                # all_pairs may hold the pair in either orientation
+                if (other, leg) in infeasible_pairs or (leg, other) in infeasible_pairs:
+                    score = -1
+                    break
+                if (other, leg) in todo or (leg, other) in todo:
+                    score += 1
+
+            if best_score is None or score > best_score:
+                best, best_score = [value], score
+            elif score == best_score:
+                best.append(value)
+
+        row[name] = random.choice(best)
     return row
 
 #Sets up the data structures that are needed to implement the algorithm
@@ -483,92 +741,138 @@ def build_row_from_pair(pair, cfg):
 #using the todo list to check the pairs that appear there
 #Either they'll be infeasible or feasible - in both cases they'll be removed from the todo. 
 # If they're infeasible - they'll be moved to a specific list, so we'll not use them again while building the other rows
-def gen_tests(model_path, settings_path):
+def gen_tests(model_path, settings_path, jobs=None, batch_size=4):
     cfg = load_cfg(settings_path)
     pairs = all_pairs(cfg["factors"])
     todo = set(pairs)
+    # the same pairs as a list, so random picks need no copy of todo;
+    # pairs leave todo first and are only dropped from the list when it gets compacted
+    todo_list = list(pairs)
     
     tests = []
     infeasible_pairs = set()
     infeasible_rows = set()
+    infeasible_phis = set()     # phi_for_row strings already proven infeasible (interned)
+    feasible_pair_set = set()   # pairs nuXmv already found feasible on their own
     seen_rows = set()
     row_to_line = {}
 
+    # nuXmv does the heavy lifting in a child process, so threads are enough to keep
+    # several oracle calls in flight at once; each call checks up to `batch_size` formulas
+    jobs = jobs or os.cpu_count() or 1
+    round_size = jobs * batch_size
 
-
-    while todo:
-        pair = random.choice(tuple(todo))
-        candidate_row = build_row_from_pair(pair, cfg)
-        k = row_key(candidate_row)
-        
-        if k in infeasible_rows:
-            todo.remove(pair)
-            continue
-        
-        is_feasible_row, trace = test_row(candidate_row, cfg, model_path)
-    
-        if not is_feasible_row:
-            row = candidate_row
-
-            # Collect all pairs appearing in this row
-            factor_names = sorted(cfg["factors"].keys())
-            row_pairs = set()
-            for i in range(len(factor_names)):
-                for j in range(i + 1, len(factor_names)):
-                    f1, f2 = factor_names[i], factor_names[j]
-                    p = ((f1, row[f1]), (f2, row[f2]))
-                    row_pairs.add(p)
-
-            # Check with nuXmv which pairs are truly infeasible
-            any_pair_infeasible = False
-            for p in row_pairs:
-                if p not in todo:
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            while todo:
+                # compact the list once more than half of it has been resolved
+                if len(todo_list) > 2 * len(todo):
+                    todo_list = [p for p in todo_list if p in todo]
+
+                # Pick up to `round_size` pending pairs and build their candidate rows.
+                # Pairs that inflate to the same row are only sent to nuXmv once.
+                # both map row_key -> (row, its pairs, its phi), computed once per candidate
+                batch = {}
+                refuted = {}            # rows holding a pair already proven infeasible: known to fail without nuXmv
+                picks = random.sample(range(len(todo_list)), min(round_size, len(todo_list)))
+                for pair in (todo_list[i] for i in picks):
+                    if pair not in todo:
+                        continue
+
+                    candidate_row = build_row_from_pair(pair, cfg, todo, infeasible_pairs)
+                    k = row_key(candidate_row)
+
+                    if k in infeasible_rows:
+                        todo.remove(pair)
+                        continue
+
+                    # a different row can still produce a formula that was already refuted
+                    phi = sys.intern(phi_for_row(candidate_row, cfg))
+                    if phi in infeasible_phis:
+                        todo.remove(pair)
+                        continue
+
+                    # the row's pairs, in the orientation all_pairs uses
+                    row_pairs = pairs_covered_by_row(candidate_row, pairs)
+
+                    # a row holding a pair that is already proven infeasible needs no nuXmv check,
+                    # but its other pairs are still diagnosed below like any infeasible row
+                    if not infeasible_pairs.isdisjoint(row_pairs):
+                        refuted.setdefault(k, (candidate_row, row_pairs, phi))
+                        continue
+
+                    batch.setdefault(k, (candidate_row, row_pairs, phi))
+
+                if not batch and not refuted:
                     continue
-                if not pair_is_feasible(p, cfg, model_path):
-                    infeasible_pairs.add(p)
-                    todo.remove(p)
-                    any_pair_infeasible = True
-
-            # If no pair is infeasible → this is a higher-order (3+ factors) infeasibility
-            # Mark the row itself as infeasible so we do not revisit it.
-            if not any_pair_infeasible:
-                infeasible_rows.add(k)
-
-
-            # In any case, do not add this row to tests
-            continue
-
-        # ----- Case: row is feasible -----
-        row = candidate_row
-
-        # If we have already produced this row, just remove any pairs it covers from todo
-                
-        if k in seen_rows:
-            # Row already produced; still remove covered pairs, but do not add a duplicate test / trace
-            for p in list(todo):
-                if row_satisfies(row, p):
-                    todo.remove(p)
-            continue
-        
-        seen_rows.add(k)
-        tests.append(row)
-        save_steps(row, trace, cfg)
-
-        #derive a test line from the trace and remember it for this row
-        test_line = trace_to_test_line(trace, cfg)
-        if test_line:
-            row_to_line[k] = test_line
-        
-        for p in list(todo):
-            if row_satisfies(row, p):
-                todo.remove(p)
-        
-        for p in list(todo):
-            if row_satisfies(row, p):
-                todo.remove(p)
 
+                slices = split_batches([row for row, _, _ in batch.values()], jobs)
+                results = [
+                    res
+                    for chunk in pool.map(lambda rows: test_rows(rows, cfg, model_path), slices)
+                    for res in chunk
+                ]
+                rows = list(batch.items()) + list(refuted.items())
+                results += [(False, "")] * len(refuted)
+
+                # Fold the verdicts back in one at a time, exactly as the serial loop did
+                for (k, (row, row_pairs, phi)), (is_feasible_row, trace) in zip(rows, results):
+
+                    if not is_feasible_row:
+                        infeasible_phis.add(phi)
+
+                        # Check with nuXmv which pairs are truly infeasible
+                        # a pair already found feasible stays in todo, but cannot explain this row
+                        pending = [p for p in row_pairs if p in todo and p not in feasible_pair_set]
+                        # an F-factor row has F*(F-1)/2 pairs, so these are capped like the row checks
+                        slices = split_batches(pending, jobs, batch_size)
+                        verdicts = [
+                            ok
+                            for chunk in pool.map(lambda ps: pairs_are_feasible(ps, cfg, model_path), slices)
+                            for ok in chunk
+                        ]
+
+                        any_pair_infeasible = False
+                        for p, feasible in zip(pending, verdicts):
+                            if feasible:
+                                feasible_pair_set.add(p)
+                            else:
+                                infeasible_pairs.add(p)
+                                todo.discard(p)
+                                any_pair_infeasible = True
+
+                        # If no pair is infeasible → this is a higher-order (3+ factors) infeasibility
+                        # Mark the row itself as infeasible so we do not revisit it.
+                        if not any_pair_infeasible:
+                            infeasible_rows.add(k)
+
+                        # In any case, do not add this row to tests
+                        continue
+
+                    # ----- Case: row is feasible -----
+
+                    # If we have already produced this row, just remove any pairs it covers from todo
+                    if k in seen_rows:
+                        # Row already produced; still remove covered pairs, but do not add a duplicate test / trace
+                        todo -= row_pairs
+                        continue
+
+                    seen_rows.add(k)
+                    tests.append(row)
+                    # one pass over the trace gives both the saved steps and the test line
+                    steps, actions = parse_trace(trace, cfg)
+                    save_steps(row, steps)
+
+                    #derive a test line from the trace and remember it for this row
+                    test_line = ",".join(actions)
+                    if test_line:
+                        row_to_line[k] = test_line
+
+                    todo -= row_pairs
+    finally:
+        # the worker threads are done, quit the nuXmv processes they kept open
+        close_nuxmv_sessions()
 
-                
     feasible_pairs = pairs - infeasible_pairs
     tests = minimize_tests_greedy(tests, feasible_pairs)
     prune_output_files(tests)
@@ -581,20 +885,26 @@ def gen_tests(model_path, settings_path):
 
 #The beginning
 def main():
+    parser = argparse.ArgumentParser(description="Generate a pairwise CTD test suite with nuXmv as the oracle.")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="number of nuXmv checks to run at once (default: number of CPUs)")
+    args = parser.parse_args()
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
     model = str(Path(MODEL_PATH).resolve())
     settings = str(Path(SETTINGS_PATH).resolve())
-    tests, infeasible, pairs = gen_tests(model, settings)        #tests = the generated CTD rows, 
+    tests, infeasible, pairs = gen_tests(model, settings, jobs=args.jobs)        #tests = the generated CTD rows, 
     
-    #Prints the tests that we need to run
+    #Prints the tests that we need to run, each listing with a single write
     print("Generated tests:")
-    for i,t in enumerate(tests, start=1):
-        print(f" Test {i}: {t}")
+    if tests:
+        print("\n".join(f" Test {i}: {t}" for i, t in enumerate(tests, start=1)))
     
     #Print the infeasible pairs
     print("\nInfeasible CTD pairs:")
     if infeasible:
-        for p in infeasible:
-            print(" ", p)
+        print("\n".join(f"  {p}" for p in infeasible))
     else:
         print("  (none)")
     print(f"\nTotal CTD pairs:     {len(pairs)}")
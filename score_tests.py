@@ -18,15 +18,26 @@ BUGS = [
 
 ALLOWED_ACTIONS = {"login", "logout", "add", "remove", "checkout"}
 
+# every parsed token is replaced by the interned string constant it equals,
+# so the comparisons in classify_test succeed on identity instead of comparing characters
+_CANONICAL_ACTIONS = {a: sys.intern(a) for a in ALLOWED_ACTIONS}
+
 def parse_test_suite(path: Path):
     """
     Reads a test suite file and returns a list of tests.
     Each test is a list of action strings.
     """
+    return list(iter_test_suite(path))
+
+def iter_test_suite(path: Path):
+    """
+    Same as parse_test_suite, but yields the (lineno, actions) tests one at a time
+    while reading the file, so a large suite never has to be held in memory.
+    detect_bugs accepts this iterator directly.
+    """
     if not path.exists():
         raise FileNotFoundError(f"Test suite file not found: {path}")
 
-    tests = []
     with path.open("r", encoding="utf-8") as f:
         for lineno, raw_line in enumerate(f, start=1):
             line = raw_line.strip()
@@ -35,79 +46,90 @@ def parse_test_suite(path: Path):
                 continue
 
             # split by comma and strip spaces
-            actions = [tok.strip() for tok in line.split(",") if tok.strip()]
+            tokens = [tok.strip() for tok in line.split(",") if tok.strip()]
 
             # (optional) basic validation: only allowed actions
-            for a in actions:
-                if a not in ALLOWED_ACTIONS:
+            actions = []
+            for tok in tokens:
+                a = _CANONICAL_ACTIONS.get(tok)
+                if a is None:
                     raise ValueError(
-                        f"Invalid action '{a}' on line {lineno} in {path}"
+                        f"Invalid action '{tok}' on line {lineno} in {path}"
                     )
+                actions.append(a)
 
-            tests.append((lineno, actions))
-
-    return tests
+            yield lineno, actions
 
 def detect_bugs(tests):
     """
     Detects planted bugs in the given tests.
     Input:
-      tests: list of (lineno, actions_list)
+      tests: iterable of (lineno, actions_list), e.g. from iter_test_suite
     Output:
       dict: bug_id -> list of line numbers that triggered this bug
     """
     # Initialize result dictionary: each bug id -> empty list of lines
     results = {bug["id"]: [] for bug in BUGS}
 
+    # suites often repeat a test, each distinct action sequence is classified once
+    seen = {}
+
     for lineno, actions in tests:
+        key = tuple(actions)
+        hits = seen.get(key)
+        if hits is None:
+            hits = seen[key] = classify_test(actions)
+
+        for bug_id, hit in hits.items():
+            if hit:
+                results[bug_id].append(lineno)
+
+    return results
+
+def classify_test(actions):
+    """
+    Returns a dict: bug_id -> bool, telling whether this test triggers that bug.
+    """
+    # One pass over the actions collects what every bug check needs
+    checkouts = 0                       # checkouts seen so far
+    add_before_first_checkout = False
+    logout_after_checkout = False
+    items = 0                           # cart size, capped at 5
+    checkout_with_two_items = False
+
+    for a in actions:
+        if a == "add":
+            if not checkouts:
+                add_before_first_checkout = True
+            if items < 5:
+                items += 1
+        elif a == "remove":
+            if items > 0:
+                items -= 1
+        elif a == "checkout":
+            checkouts += 1
+            if items == 2:
+                checkout_with_two_items = True
+        elif a == "logout" and checkouts:
+            logout_after_checkout = True
+
+    return {
         # ---------------------------------
         # Bug 1 – Double checkout 
         # ---------------------------------
-        if "Bug 1" in results:
-            checkout_indices = [i for i, a in enumerate(actions) if a == "checkout"]
-            if len(checkout_indices) >= 2:
-                first_checkout_idx = checkout_indices[0]
-                has_add_before_first_checkout = any(
-                    a == "add" for a in actions[:first_checkout_idx]
-                )
-                if has_add_before_first_checkout:
-                    results["Bug 1"].append(lineno)
+        "Bug 1": checkouts >= 2 and add_before_first_checkout,
 
         # ---------------------------------
         # Bug 2 – Logout after checkout
         # ---------------------------------
-        if "Bug 2" in results:
-            checkout_indices = [i for i, a in enumerate(actions) if a == "checkout"]
-            logout_indices = [i for i, a in enumerate(actions) if a == "logout"]
-            if checkout_indices and logout_indices:
-                has_checkout_before_logout = any(
-                    ci < li for ci in checkout_indices for li in logout_indices
-                )
-                if has_checkout_before_logout:
-                    results["Bug 2"].append(lineno)
-
+        "Bug 2": logout_after_checkout,
 
         # ---------------------------------
         # Bug 3 – Checkout with two items
         # At any checkout in the test, items == 2 at that point
         # ---------------------------------
-        if "Bug 3" in results:
-            items = 0
-            triggered_bug3 = False
-            for a in actions:
-                if a == "add" and items < 5:
-                    items += 1
-                elif a == "remove" and items > 0:
-                    items -= 1
-
-                if a == "checkout" and items == 2:
-                    triggered_bug3 = True
-                    break
-
-            if triggered_bug3:
-                results["Bug 3"].append(lineno)
-
-    return results
+        "Bug 3": checkout_with_two_items,
+    }
 
 
 
@@ -119,18 +141,25 @@ def main():
 
     suite_path = Path(sys.argv[1])
 
-    try:
-        tests = parse_test_suite(suite_path)
-    except Exception as e:
-        print(f"Error while reading test suite: {e}")
-        sys.exit(1)
-
-    print(f"Loaded {len(tests)} tests from {suite_path}")
-    for lineno, actions in tests:
-        print(f"  line {lineno}: {actions}")
+    # the suite is parsed and scored in one pass, so the parsed tests are never kept as a list
+    # (detect_bugs still remembers one verdict per distinct action sequence)
+    loaded = 0
+
+    def counted(tests):
+        # parse errors surface here, while detect_bugs asks for the next test
+        nonlocal loaded
+        try:
+            for test in tests:
+                loaded += 1
+                yield test
+        except Exception as e:
+            print(f"Error while reading test suite: {e}")
+            sys.exit(1)
 
     # Step 1: call bug detection
-    bug_hits = detect_bugs(tests)
+    bug_hits = detect_bugs(counted(iter_test_suite(suite_path)))
+
+    print(f"Loaded {loaded} tests from {suite_path}")
 
     # Compute score
     total_bugs = len(BUGS)